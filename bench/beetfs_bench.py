@@ -0,0 +1,250 @@
+"""Benchmark beetfs against a generated library, without mounting anything
+
+Builds a temporary beets library of small MP3 and FLAC files (ID3 tags,
+Vorbis comments and embedded pictures), then drives the Operations
+coroutines directly under trio and reports mount time, RSS of the tree
+per track, peak RSS, lookup/getattr/readdir latency percentiles and
+sequential read throughput.
+
+    python bench/beetfs_bench.py --tracks 1000 10000
+
+Each scale is measured in a fresh process so that peak RSS only covers
+the mount and the operations, not the library generation. pyfuse3 must be
+importable; only its readdir_reply and invalidation calls are replaced.
+"""
+import argparse, json, os, random, resource, shutil, struct, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PICTURE = b'\xff\xd8\xff\xe0' + bytes(range(256)) * 32 # stands in for an 8 KiB JPEG
+CHUNK = 128 * 1024 # read size of a streaming client
+
+def flac_bytes(title, artist, payload, picture=None):
+    packed = (44100 << 44) | (1 << 41) | (15 << 36) | 44100 * 60 # 44.1 kHz, stereo, 16 bit, one minute
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(6) + packed.to_bytes(8, 'big') + bytes(16)
+    vendor = b'beetfs-bench'
+    comments = [('TITLE=' + title).encode('utf-8'), ('ARTIST=' + artist).encode('utf-8')]
+    vorbis = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(comments))
+    vorbis += b''.join(struct.pack('<I', len(comment)) + comment for comment in comments)
+    blocks = [(0, streaminfo), (4, vorbis)]
+    if picture:
+        mime = b'image/jpeg'
+        blocks.append((6, struct.pack('>II', 3, len(mime)) + mime + struct.pack('>I', 0)
+                       + struct.pack('>IIII', 500, 500, 24, 0) + struct.pack('>I', len(picture)) + picture))
+    blocks.append((1, bytes(1024))) # PADDING
+    data = b'fLaC'
+    for i, (block_type, block) in enumerate(blocks):
+        data += bytes([block_type | (0x80 if i == len(blocks) - 1 else 0)]) + len(block).to_bytes(3, 'big') + block
+    return data + b'\xff\xf8' + payload
+
+def write_mp3(path, title, artist, payload, picture=None):
+    from mutagen.id3 import ID3, TIT2, TPE1, APIC
+    with open(path, 'wb') as mp3:
+        mp3.write(b'\xff\xfb\x90\x00' + payload) # MPEG frame sync
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=title))
+    tags.add(TPE1(encoding=3, text=artist))
+    if picture:
+        tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='cover', data=picture))
+    tags.save(path)
+
+def generate(root, tracks, per_album, payload_size):
+    """Create a beets library with tracks split into albums of per_album tracks"""
+    from beets.library import Library, Item
+    os.makedirs(root, exist_ok=True)
+    lib = Library(os.path.join(root, 'library.db'), directory=os.path.join(root, 'music'))
+    payload = os.urandom(payload_size)
+    with lib.transaction():
+        for album in range((tracks + per_album - 1) // per_album):
+            artist = f'Artist {album // 10}'
+            album_dir = os.path.join(root, 'music', artist, f'Album {album}')
+            os.makedirs(album_dir, exist_ok=True)
+            if album % 3 == 2: # some albums have a cover file instead of embedded art
+                with open(os.path.join(album_dir, 'cover.jpg'), 'wb') as cover:
+                    cover.write(PICTURE)
+            items = []
+            for track in range(min(per_album, tracks - album * per_album)):
+                title = f'Track {track}'
+                picture = PICTURE if album % 3 != 2 and track == 0 else None
+                if (album + track) % 2:
+                    path = os.path.join(album_dir, f'{track:02}.mp3')
+                    write_mp3(path, title, artist, payload, picture)
+                else:
+                    path = os.path.join(album_dir, f'{track:02}.flac')
+                    with open(path, 'wb') as flac:
+                        flac.write(flac_bytes(title, artist, payload, picture))
+                items.append(Item(path=os.fsencode(path), title=title, artist=artist, albumartist=artist,
+                                  album=f'Album {album}', year=2000 + album % 20, track=track + 1,
+                                  genre='Rock', format='FLAC' if path.endswith('.flac') else 'MP3',
+                                  mtime=os.path.getmtime(path)))
+            lib.add_album(items)
+    lib._close()
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return {'n': len(samples), 'p50_us': round(pick(0.50), 1), 'p90_us': round(pick(0.90), 1),
+            'p99_us': round(pick(0.99), 1), 'max_us': round(samples[-1] * 1e6, 1)}
+
+def rss_kib():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+def measure(root, samples, read_files, scan_workers=None):
+    """Mount the library in root in-process and time the filesystem operations"""
+    sys.path.insert(0, ROOT)
+    import trio, pyfuse3
+    from beets import config
+    from beets.library import Library
+    from beetsplug import beetfs, _beetfs
+    config['beetfs'].set({'refresh_interval': 0}) # everything else as configured by default, layout cache included
+    if scan_workers:
+        config['beetfs'].set({'lazy': False, 'scan_workers': scan_workers})
+
+    # stand-in for the kernel: collect readdir entries, drop invalidations
+    def readdir_reply(token, name, attr, next_id):
+        token.append((name, attr, next_id))
+        return True
+    pyfuse3.readdir_reply = readdir_reply
+    pyfuse3.invalidate_entry_async = lambda *args, **kwargs: None
+    pyfuse3.invalidate_inode = lambda *args, **kwargs: None
+
+    beetfs.beetfs() # registers the config defaults
+    _beetfs.library = Library(os.path.join(root, 'library.db'), directory=os.path.join(root, 'music'))
+    results = {}
+    rss_before = rss_kib() # interpreter, beets and the open library
+    started = time.perf_counter()
+    ops = _beetfs.Operations()
+    results['mount_s'] = round(time.perf_counter() - started, 3)
+    results['nodes'] = len(ops.inode_table)
+    results['rss_after_mount_kib'] = rss_kib()
+    # what the tree costs, the peak also covers the rows and Items seen while building it
+    results['tree_rss_kib'] = results['rss_after_mount_kib'] - rss_before
+    results['tree_rss_per_track_b'] = round(results['tree_rss_kib'] * 1024 / max(len(ops.records), 1))
+
+    rng = random.Random(0)
+    files = [node for node in ops.inode_table.values() if node.record]
+    directories = [node for node in ops.inode_table.values() if node.children is not None]
+    picked = rng.sample(files, min(samples, len(files)))
+
+    async def run():
+        timings = {'lookup': [], 'getattr': [], 'readdir': []}
+        for node in picked: # walk down from the root like path resolution does
+            names = node.mount_path.split('/')[1:]
+            inode = pyfuse3.ROOT_INODE
+            for name in names:
+                started = time.perf_counter()
+                entry = await ops.lookup(inode, name.encode('utf-8'))
+                timings['lookup'].append(time.perf_counter() - started)
+                inode = entry.st_ino
+        for node in picked:
+            started = time.perf_counter()
+            await ops.getattr(node.inode)
+            timings['getattr'].append(time.perf_counter() - started)
+        # listing a directory materializes its files and locates its art, and
+        # how many of them the lookups above reached depends on the library
+        # size, so list the sampled directories once and time the second pass
+        listed = rng.sample(directories, min(samples, len(directories)))
+        for timed in (False, True):
+            for node in listed:
+                token = []
+                started = time.perf_counter()
+                handle = await ops.opendir(node.inode, None)
+                await ops.readdir(handle, 0, token)
+                if timed:
+                    timings['readdir'].append(time.perf_counter() - started)
+                await ops.releasedir(handle)
+        for op, samples_ in timings.items():
+            results[op] = percentiles(samples_)
+
+        read_bytes = 0
+        started = time.perf_counter()
+        async with trio.open_nursery() as nursery:
+            ops.nursery = nursery # lets readahead prefetch like it does when mounted
+            for node in picked[:read_files]:
+                info = await ops.open(node.inode, os.O_RDONLY, None)
+                off = 0
+                while True:
+                    data = await ops.read(info.fh, off, CHUNK)
+                    if not data:
+                        break
+                    off += len(data)
+                await ops.release(info.fh)
+                read_bytes += off
+            nursery.cancel_scope.cancel()
+        elapsed = time.perf_counter() - started
+        results['read'] = {'files': min(read_files, len(picked)), 'bytes': read_bytes,
+                           'mib_per_s': round(read_bytes / elapsed / 2**20, 1) if elapsed else None}
+
+    trio.run(run)
+    ops.close()
+    results['peak_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+def check_scaling(results, max_ratio=None):
+    """Compare the latencies of the smallest and largest library, they should not grow with its size"""
+    smallest, largest = results[min(results)], results[max(results)]
+    scaling = {'tracks': [min(results), max(results)]}
+    for op in ('lookup', 'getattr', 'readdir'):
+        scaling[op] = {f'{q}_ratio': round(largest[op][f'{q}_us'] / smallest[op][f'{q}_us'], 2)
+                       for q in ('p50', 'p99') if smallest[op].get(f'{q}_us')}
+    # RSS growth per track between the two sizes, without what any mount costs
+    added = max(results) - min(results)
+    scaling['rss_per_100k_tracks_mib'] = round((largest['rss_after_mount_kib'] - smallest['rss_after_mount_kib'])
+                                               / added * 100000 / 1024, 1)
+    print(json.dumps({'scaling': scaling}))
+    grown = [op for op in ('lookup', 'getattr', 'readdir') if scaling[op].get('p50_ratio', 0) > (max_ratio or float('inf'))]
+    if grown:
+        sys.exit(f'median latency of {", ".join(grown)} grew more than {max_ratio}x')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tracks', type=int, nargs='+', default=[1000], help='library sizes to measure')
+    parser.add_argument('--per-album', type=int, default=12, help='tracks per album')
+    parser.add_argument('--payload', type=int, default=64, help='KiB of audio data per file')
+    parser.add_argument('--samples', type=int, default=1000, help='nodes sampled for the latency measurements')
+    parser.add_argument('--read-files', type=int, default=100, help='files read front to back for throughput')
+    parser.add_argument('--keep', metavar='DIR', help='generate the libraries in DIR and keep them')
+    parser.add_argument('--measure', metavar='DIR', help=argparse.SUPPRESS) # run in the child process
+    parser.add_argument('--layout-cache', action='store_true', help='mount a second time, from the layout cache the first mount filled')
+    parser.add_argument('--scan-workers', type=int, help='mount eagerly, reading the files in this many processes')
+    parser.add_argument('--check-flat', type=float, metavar='RATIO',
+                        help='fail if a median latency at the largest scale exceeds RATIO times the smallest')
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.samples, args.read_files, args.scan_workers)))
+        return
+
+    base = args.keep or tempfile.mkdtemp(prefix='beetfs-bench-')
+    cold = {} # tracks -> results of the mount that filled the layout cache
+    try:
+        for tracks in args.tracks:
+            root = os.path.join(base, str(tracks))
+            if not os.path.exists(os.path.join(root, 'library.db')):
+                started = time.perf_counter()
+                generate(root, tracks, args.per_album, args.payload * 1024)
+                print(f'generated {tracks} tracks in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+            runs = ['cold', 'warm'] if args.layout_cache else ['cold']
+            for run in runs:
+                if run == 'cold' and os.path.exists(os.path.join(root, 'library.db.beetfs')):
+                    os.remove(os.path.join(root, 'library.db.beetfs'))
+                child = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', root,
+                                        '--samples', str(args.samples), '--read-files', str(args.read_files)]
+                                       + (['--scan-workers', str(args.scan_workers)] if args.scan_workers else []),
+                                       capture_output=True, text=True)
+                if child.returncode:
+                    sys.exit(child.stderr)
+                results = json.loads(child.stdout.splitlines()[-1])
+                print(json.dumps({'tracks': tracks, 'run': run, **results}))
+                if run == 'cold':
+                    cold[tracks] = results
+        if len(cold) > 1:
+            check_scaling(cold, args.check_flat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
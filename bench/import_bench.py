@@ -0,0 +1,50 @@
+"""Measure what importing the beetfs plugin costs every beet command
+
+beets imports each enabled plugin on every run, so `beet ls` pays for
+whatever beetsplug.beetfs imports. This imports it in fresh interpreters
+under `python -X importtime`, after the beets modules that are loaded
+before plugins anyway, and reports the median import time along with any
+module that only mounting should need:
+
+    python bench/import_bench.py --runs 20
+
+Exits with status 1 if one of those modules is imported.
+"""
+import argparse, json, statistics, subprocess, sys, os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOUNT_ONLY = ['pyfuse3', 'trio', 'pathvalidate', 'beetsplug._beetfs'] # imported by `beet mount` only
+PRELOADED = 'import beets.ui, beets.library, beets.plugins' # what beets imports before loading plugins
+
+def import_time(module):
+    """Import module in a fresh interpreter, returning its cumulative import time and what it imported"""
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'{PRELOADED}; import {module}'],
+                           capture_output=True, text=True, cwd=ROOT)
+    if child.returncode:
+        sys.exit(child.stderr)
+    imported = {}
+    for line in child.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported[name.strip()] = int(cumulative)
+    return imported
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters to measure')
+    parser.add_argument('--module', default='beetsplug.beetfs', help='module to import')
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.runs):
+        imported = import_time(args.module)
+        times.append(imported[args.module] / 1000)
+    mount_only = [name for name in MOUNT_ONLY if name in imported and name != args.module]
+    print(json.dumps({'module': args.module, 'runs': args.runs, 'median_ms': round(statistics.median(times), 1),
+                      'max_ms': round(max(times), 1), 'mount_only_imports': mount_only}))
+    if mount_only and args.module == 'beetsplug.beetfs':
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()